@@ -12,8 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
+import os
+import subprocess
 import sys
 import textwrap
+from collections import deque
 from pathlib import Path
 from itertools import chain
 
@@ -22,6 +27,38 @@ from SCons.Script import ARGUMENTS, Builder
 
 Import("env")
 
+CMAKE_LISTS_TEMPLATE = textwrap.dedent(
+    """
+    cmake_minimum_required(VERSION 3.20.0)
+
+    set(Zephyr_DIR "$ENV{{ZEPHYR_BASE}}/share/zephyr-package/cmake/")
+
+    find_package(Zephyr)
+
+    project({project})
+
+    SET(CMAKE_CXX_FLAGS  "${{CMAKE_CXX_FLAGS}} {build_flags}")
+    SET(CMAKE_C_FLAGS  "${{CMAKE_C_FLAGS}} {build_flags}")
+    zephyr_ld_options({link_flags})
+
+    target_sources(app PRIVATE {sources})
+    target_include_directories(app PRIVATE ../src)
+    """
+)
+
+APP_MAIN_TEMPLATE = textwrap.dedent(
+    """
+    #include <zephyr.h>
+    void main(void) {}
+    """
+)
+
+
+def _content_fingerprint(path: Path):
+    if not path.is_file():
+        return None
+    return hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+
 
 class BuildEnvironment:
     def __init__(self, project_dir: Path, source_dir: Path, build_dir: Path, sdk):
@@ -31,77 +68,112 @@ class BuildEnvironment:
         self.app_dir = project_dir / "zephyr"
         self.sdk = sdk
         self.reconfigure_required = False
-
-    def run(self, cmd: list[str], cwd=None):
+        self.cmake_file = self.app_dir / "CMakeLists.txt"
+        self.pm_static_file = self.app_dir / "pm_static.yml"
+        self.cmake_cache_file = build_dir / "CMakeCache.txt"
+        self.build_ninja_file = build_dir / "build.ninja"
+        self.fingerprints_file = build_dir / ".pio_fingerprints.json"
+        self.fingerprints = {}
+
+    def run(self, cmd: list[str | os.PathLike], cwd=None):
         if not cwd:
             cwd = self.sdk.sdk_path
         ret = exec_command(cmd, env=self.sdk.env, cwd=cwd)
         if ret["returncode"] != 0:
             raise RuntimeError(
-                f"Command {' '.join(cmd)} failed:\n{ret['out']}\n{ret['err']}"
+                f"Command {' '.join(map(str, cmd))} failed:\n{ret['out']}\n{ret['err']}"
             )
         return (ret["out"], ret["err"])
 
-    def _is_reconfigure_required(self, board):
+    def run_streaming(self, cmd: list[str | os.PathLike], cwd=None, verbose=False):
+        # Forward output as it is produced and keep only the tail for errors
+        if not cwd:
+            cwd = self.sdk.sdk_path
+        tail = deque(maxlen=200)
+        with subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            env=self.sdk.env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
+            text=True,
+            errors="replace",
+        ) as proc:
+            for line in proc.stdout:
+                tail.append(line)
+                if verbose:
+                    sys.stdout.write(line)
+        if proc.returncode != 0:
+            raise RuntimeError(
+                f"Command {' '.join(map(str, cmd))} failed:\n{''.join(tail)}"
+            )
+
+    def _load_fingerprints(self):
+        try:
+            self.fingerprints = json.loads(self.fingerprints_file.read_text())
+        except (OSError, ValueError):
+            self.fingerprints = {}
+
+    def _save_fingerprints(self, fingerprints: dict):
+        # A pristine build may have wiped the build dir, so a missing file is
+        # rewritten even when nothing changed
+        if self.fingerprints_file.is_file() and all(
+            self.fingerprints.get(k) == v for k, v in fingerprints.items()
+        ):
+            return
+        self.fingerprints.update(fingerprints)
+        self.fingerprints_file.write_text(json.dumps(self.fingerprints, indent=2))
+
+    def _config_fingerprints(self, board):
+        return {
+            "pm_static": _content_fingerprint(self.pm_static_file),
+            "board": _content_fingerprint(
+                self.project_dir / "boards" / f"{board}.json"
+            ),
+        }
+
+    def _is_reconfigure_required(self, config_fingerprints: dict):
         if self.sdk.fresh_install or self.reconfigure_required:
             return True
-        cmake_cache_file = self.build_dir / "CMakeCache.txt"
-        if not cmake_cache_file.is_file():
-            return True
-        build_ninja_file = self.build_dir / "build.ninja"
-        if not build_ninja_file.is_file():
-            return True
-        pm_static_file = self.project_dir / "zephyr" / "pm_static.yml"
-        if (
-            pm_static_file.is_file()
-            and pm_static_file.stat().st_mtime > cmake_cache_file.stat().st_mtime
-        ):
-            # Reconfigure if pm_static.yml has changed
+        if not self.cmake_cache_file.is_file():
             return True
-        board_file = self.project_dir / "boards" / f"{board}.json"
-        if board_file.is_file() and board_file.stat().st_mtime > cmake_cache_file.stat().st_mtime:
-            # Reconfigure if the board configuration has changed
+        if not self.build_ninja_file.is_file():
             return True
-        return False
+        # Reconfigure if pm_static.yml or the board configuration content has changed
+        return any(
+            self.fingerprints.get(name) != fingerprint
+            for name, fingerprint in config_fingerprints.items()
+        )
 
     def _generate_project_files(
         self, build_flags: list[str], link_flags: list[str], source_files: list[Path]
     ):
         sources = [str(f.relative_to(self.app_dir, walk_up=True)) for f in source_files]
         self.app_dir.mkdir(parents=True, exist_ok=True)
-        cmake_file = self.app_dir / "CMakeLists.txt"
-        cmake_tpl = textwrap.dedent(
-            f"""
-            cmake_minimum_required(VERSION 3.20.0)
-
-            set(Zephyr_DIR "$ENV{{ZEPHYR_BASE}}/share/zephyr-package/cmake/")
-
-            find_package(Zephyr)
-
-            project({self.project_dir.name})
-
-            SET(CMAKE_CXX_FLAGS  "${{CMAKE_CXX_FLAGS}} {' '.join(build_flags)}")
-            SET(CMAKE_C_FLAGS  "${{CMAKE_C_FLAGS}} {' '.join(build_flags)}")
-            zephyr_ld_options({' '.join(link_flags)})
-
-            target_sources(app PRIVATE {" ".join(sources)})
-            target_include_directories(app PRIVATE ../src)
-            """
+        cmake_tpl = CMAKE_LISTS_TEMPLATE.format(
+            project=self.project_dir.name,
+            build_flags=" ".join(build_flags),
+            link_flags=" ".join(link_flags),
+            sources=" ".join(sources),
         )
-
-        app_tpl = textwrap.dedent(
-            """
-            #include <zephyr.h>
-            void main(void) {}
-            """
-        )
-        if not cmake_file.is_file() or cmake_file.read_text() != cmake_tpl:
-            cmake_file.write_text(cmake_tpl)
+        cmake_data = cmake_tpl.encode()
+        try:
+            changed = (
+                self.cmake_file.stat().st_size != len(cmake_data)
+                or self.cmake_file.read_bytes() != cmake_data
+            )
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            self.cmake_file.write_bytes(cmake_data)
             self.reconfigure_required = True
-        if not any(self.source_dir.iterdir()):
+        with os.scandir(self.source_dir) as entries:
+            source_dir_empty = next(entries, None) is None
+        if source_dir_empty:
             main_c_file = self.source_dir / "main.c"
             main_c_file.parent.mkdir(parents=True, exist_ok=True)
-            main_c_file.write_text(app_tpl)
+            main_c_file.write_text(APP_MAIN_TEMPLATE)
             self.reconfigure_required = True
 
     def _set_extra_cmake_args(self, cmake_extra_args: list[str]):
@@ -135,7 +207,9 @@ class BuildEnvironment:
         pristine: bool = False,
         verbose: bool = False,
     ):
+        self._load_fingerprints()
         self._generate_project_files(build_flags, link_flags, source_files)
+        config_fingerprints = self._config_fingerprints(board)
 
         west_cmd = [
             "west",
@@ -143,50 +217,45 @@ class BuildEnvironment:
             "--sysbuild" if sysbuild else "--no-sysbuild",
             (
                 "--pristine"
-                if pristine or self._is_reconfigure_required(board)
+                if pristine or self._is_reconfigure_required(config_fingerprints)
                 else "--pristine=auto"
             ),
             "-b",
             board,
             "-d",
-            str(self.build_dir),
-            str(self.app_dir),
+            self.build_dir,
+            self.app_dir,
         ]
         print("Building nRF Connect SDK application...")
         if verbose:
             print(" ".join(map(str, west_cmd)))
 
-        out, err = self.run(west_cmd)
-        if verbose:
-            print(out)
-            print(err)
-
-
-def c_flags_from_env(env):
-    return env.get("BUILD_FLAGS", [])
+        self.run_streaming(west_cmd, verbose=verbose)
+        self._save_fingerprints(config_fingerprints)
 
 
-def link_flags_from_env(env):
-    return [x for x in env.get("BUILD_FLAGS", []) if x.startswith("-Wl,")]
+def flags_from_env(env):
+    build_flags = env.get("BUILD_FLAGS", [])
+    return build_flags, [x for x in build_flags if x.startswith("-Wl,")]
 
 
 def source_files_from_env(env):
     files = chain.from_iterable(env.get("PIOBUILDFILES"))
-    files = chain.from_iterable([f.sources for f in files])
-    files = [Path((f.srcnode().get_abspath())) for f in files]
-    files.sort()
-    return files
+    files = chain.from_iterable(f.sources for f in files)
+    # Sort the plain path strings; comparing Path objects is much slower
+    return [Path(f) for f in sorted(f.srcnode().get_abspath() for f in files)]
 
 
 def west_build(build_env: BuildEnvironment, target, sources, env):
     pristine = env.GetProjectOption("pristine", "False").lower() == "true"
     sysbuild = env.GetProjectOption("sysbuild", "True").lower() == "true"
     board = env.BoardConfig()
+    build_flags, link_flags = flags_from_env(env)
 
     build_env.build(
         board=board.get("board_name"),
-        build_flags=c_flags_from_env(env),
-        link_flags=link_flags_from_env(env),
+        build_flags=build_flags,
+        link_flags=link_flags,
         source_files=sources,
         sysbuild=sysbuild,
         pristine=pristine,
@@ -33,23 +33,23 @@ def get_nrfutil(env):
 def get_sdk(env):
     nrfutil = get_nrfutil(env)
     version = get_sdk_version(env)
-    sdk = nrfutil.get_sdk(version, get_sdk_location(env))
+    location = get_sdk_location(env)
+    sdk = nrfutil.get_sdk(version, location)
     if not sdk:
-        raise RuntimeError(
-            f"SDK version {version} not found in {get_sdk_location(env)}."
-        )
+        raise RuntimeError(f"SDK version {version} not found in {location}.")
     return sdk
 
 
 def install_sdk(env):
     nrfutil = get_nrfutil(env)
     version = get_sdk_version(env)
-    sdk = nrfutil.get_sdk(version, get_sdk_location(env))
+    location = get_sdk_location(env)
+    sdk = nrfutil.get_sdk(version, location)
     if sdk:
         print(f"SDK version {version} is already installed.")
         return sdk
     print(f"Installing SDK version {version}...")
-    return nrfutil.install_sdk(version, get_sdk_location(env))
+    return nrfutil.install_sdk(version, location)
 
 
 def get_uf2conv(env):